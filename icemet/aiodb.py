@@ -0,0 +1,123 @@
+from icemet.db import (
+	ParticlesRow, StatsRow,
+	_particles_values, _stats_values, _filter_tables, _table_fmt,
+	__create_db_fmt__,
+	__select_tables_fmt__,
+	__select_particles_fmt__, __select_stats_fmt__,
+	__insert_particles_fmt__, __insert_stats_fmt__,
+	__update_particles_fmt__, __update_stats_fmt__
+)
+
+import aiomysql
+
+import asyncio
+
+class AsyncDatabase:
+	def __init__(self, **kwargs):
+		self.host = kwargs.get("host", "localhost")
+		self.port = kwargs.get("port", 3306)
+		self.user = kwargs.get("user", "root")
+		self.password = kwargs.get("password", "")
+		self.concurrency = kwargs.get("concurrency", 10)
+		self._pool = None
+	
+	def __repr__(self):
+		return "<AsyncDatabase {}@{}:{}>".format(self.user, self.host, self.port)
+	
+	async def __aenter__(self):
+		await self.connect()
+		return self
+	
+	async def __aexit__(self, *args):
+		await self.close()
+	
+	async def connect(self):
+		# The pool size is the concurrency limit: every query holds one
+		# connection until its rows have been consumed. Autocommit keeps
+		# selects from leaving connections in an open transaction, which the
+		# pool would close instead of reusing.
+		self._pool = await aiomysql.create_pool(
+			host=self.host,
+			port=self.port,
+			user=self.user,
+			password=self.password,
+			minsize=1,
+			maxsize=self.concurrency,
+			autocommit=True
+		)
+	
+	async def close(self):
+		if self._pool is None:
+			return
+		self._pool.close()
+		await self._pool.wait_closed()
+		self._pool = None
+	
+	async def databases(self, table_prefixes=["particles", "stats"]):
+		async with self._pool.acquire() as conn:
+			async with conn.cursor(aiomysql.DictCursor) as curs:
+				await curs.execute(__select_tables_fmt__)
+				return _filter_tables(await curs.fetchall(), table_prefixes)
+	
+	async def particles_databases(self):
+		return await self.databases(["particles"])
+	
+	async def stats_databases(self):
+		return await self.databases(["stats"])
+	
+	async def create_table(self, database, table):
+		table_fmt = _table_fmt(table)
+		async with self._pool.acquire() as conn:
+			async with conn.cursor() as curs:
+				await curs.execute(__create_db_fmt__.format(database))
+				await curs.execute(table_fmt.format(database, table))
+			await conn.commit()
+	
+	async def select(self, query, cls=None):
+		async with self._pool.acquire() as conn:
+			async with conn.cursor(aiomysql.SSDictCursor) as curs:
+				await curs.execute(query)
+				while True:
+					row = await curs.fetchone()
+					if row is None:
+						break
+					yield row if cls is None else cls(**row)
+	
+	def select_particles(self, database, table):
+		return self.select(__select_particles_fmt__.format(database, table), cls=ParticlesRow)
+	
+	def select_stats(self, database, table):
+		return self.select(__select_stats_fmt__.format(database, table), cls=StatsRow)
+	
+	async def gather(self, func, tables):
+		async def fetch(database, table):
+			return [row async for row in func(database, table)]
+		return await asyncio.gather(*[fetch(database, table) for database, table in tables])
+	
+	async def select_all_particles(self, tables):
+		return await self.gather(self.select_particles, tables)
+	
+	async def select_all_stats(self, tables):
+		return await self.gather(self.select_stats, tables)
+	
+	async def _execute_many(self, query, values):
+		async with self._pool.acquire() as conn:
+			async with conn.cursor() as curs:
+				await curs.executemany(query, values)
+			await conn.commit()
+	
+	async def insert_particles(self, database, table, rows):
+		values = [_particles_values(row) for row in rows]
+		await self._execute_many(__insert_particles_fmt__.format(database, table), values)
+	
+	async def insert_stats(self, database, table, rows):
+		values = [_stats_values(row) for row in rows]
+		await self._execute_many(__insert_stats_fmt__.format(database, table), values)
+	
+	async def update_particles(self, database, table, rows):
+		values = [(*_particles_values(row), row.ID) for row in rows]
+		await self._execute_many(__update_particles_fmt__.format(database, table), values)
+	
+	async def update_stats(self, database, table, rows):
+		values = [(*_stats_values(row), row.ID) for row in rows]
+		await self._execute_many(__update_stats_fmt__.format(database, table), values)
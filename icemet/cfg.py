@@ -1,5 +1,15 @@
 import yaml
 
+import copy
+import os
+
+# Prefer the libyaml bindings when PyYAML was built with them
+_Loader = getattr(yaml, "CLoader", yaml.Loader)
+_Dumper = getattr(yaml, "CDumper", yaml.Dumper)
+
+# Parsed files keyed by path, invalidated by mtime and size
+_cache = {}
+
 class ConfigException(Exception):
 	pass
 
@@ -7,6 +17,7 @@ class Config:
 	def __init__(self, fn):
 		self.file = fn
 		self.dict = {}
+		self._stamp = None
 		self.read(fn)
 	
 	def __setitem__(self, key, val):
@@ -20,13 +31,36 @@ class Config:
 	def get(self, key, default=None):
 		return self.dict.get(key, default)
 	
+	def _load(self, fn, stamp):
+		path = os.path.abspath(fn)
+		cached = _cache.get(path)
+		if not cached is None and cached[0] == stamp:
+			return copy.deepcopy(cached[1])
+		with open(fn, "r") as fp:
+			dict = yaml.load(fp, Loader=_Loader)
+		_cache[path] = (stamp, dict)
+		return copy.deepcopy(dict)
+	
 	def read(self, fn):
 		try:
-			with open(fn, "r") as fp:
-				self.dict = yaml.load(fp, Loader=yaml.Loader)
+			st = os.stat(fn)
+			stamp = (st.st_mtime_ns, st.st_size)
+			self.dict = self._load(fn, stamp)
 		except Exception as e:
 			raise ConfigException("Couldn't parse config file '{}'\n{}".format(fn, e))
+		self.file = fn
+		self._stamp = stamp
+	
+	def reload(self):
+		try:
+			st = os.stat(self.file)
+		except Exception as e:
+			raise ConfigException("Couldn't parse config file '{}'\n{}".format(self.file, e))
+		if (st.st_mtime_ns, st.st_size) == self._stamp:
+			return False
+		self.read(self.file)
+		return True
 	
 	def write(self, fn):
 		with open(fn, "w") as fp:
-			yaml.dump(self.dict, fp, Dumper=yaml.Dumper)
+			yaml.dump(self.dict, fp, Dumper=_Dumper)
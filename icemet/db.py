@@ -4,6 +4,10 @@ import natsort
 import pymysql
 
 from collections import OrderedDict
+from datetime import datetime
+import glob
+import os
+import sqlite3
 
 __create_db_fmt__ = "CREATE DATABASE IF NOT EXISTS `{}`;"
 __create_particles_table_fmt__ = "CREATE TABLE IF NOT EXISTS `{}`.`{}` ("\
@@ -40,6 +44,38 @@ __create_stats_table_fmt__ = "CREATE TABLE IF NOT EXISTS `{}`.`{}` ("\
 "PRIMARY KEY (ID),"\
 "INDEX (DateTime)"\
 ");"
+__create_particles_table_sqlite_fmt__ = "CREATE TABLE IF NOT EXISTS `{0}`.`{1}` ("\
+"ID INTEGER PRIMARY KEY,"\
+"DateTime TEXT NOT NULL,"\
+"Sensor INTEGER NOT NULL,"\
+"Frame INTEGER NOT NULL,"\
+"Particle INTEGER NOT NULL,"\
+"X REAL NOT NULL,"\
+"Y REAL NOT NULL,"\
+"Z REAL NOT NULL,"\
+"EquivDiam REAL NOT NULL,"\
+"EquivDiamCorr REAL NOT NULL,"\
+"Circularity REAL NOT NULL,"\
+"DynRange INTEGER NOT NULL,"\
+"EffPxSz REAL NOT NULL,"\
+"SubX INTEGER NOT NULL,"\
+"SubY INTEGER NOT NULL,"\
+"SubW INTEGER NOT NULL,"\
+"SubH INTEGER NOT NULL"\
+");"\
+"CREATE INDEX IF NOT EXISTS `{0}`.`{1}_DateTime` ON `{1}` (DateTime);"
+__create_stats_table_sqlite_fmt__ = "CREATE TABLE IF NOT EXISTS `{0}`.`{1}` ("\
+"ID INTEGER PRIMARY KEY,"\
+"DateTime TEXT NOT NULL,"\
+"LWC REAL NOT NULL,"\
+"MVD REAL NOT NULL,"\
+"Conc REAL NOT NULL,"\
+"Frames INTEGER NOT NULL,"\
+"Particles INTEGER NOT NULL,"\
+"Temp REAL,"\
+"Wind REAL"\
+");"\
+"CREATE INDEX IF NOT EXISTS `{0}`.`{1}_DateTime` ON `{1}` (DateTime);"
 __select_tables_fmt__ = "SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.TABLES;"
 __select_particles_fmt__ = "SELECT ID, DateTime, Sensor, Frame, Particle, X, Y, Z, EquivDiam, EquivDiamCorr, Circularity, DynRange, EffPxSz, SubX, SubY, SubW, SubH FROM `{}`.`{}` ORDER BY ID ASC;"
 __select_stats_fmt__ = "SELECT ID, DateTime, LWC, MVD, Conc, Frames, Particles, Temp, Wind FROM `{}`.`{}` ORDER BY DateTime ASC;"
@@ -51,6 +87,37 @@ __update_stats_fmt__ = "UPDATE `{}`.`{}` SET DateTime=%s, LWC=%s, MVD=%s, Conc=%
 class DBException(Exception):
 	pass
 
+def _particles_values(row):
+	return (row.DateTime.strftime("%Y-%m-%d %H:%M:%S.%f"), row.Sensor, row.Frame, row.Particle, row.X, row.Y, row.Z, row.EquivDiam, row.EquivDiamCorr, row.Circularity, row.DynRange, row.EffPxSz, row.SubX, row.SubY, row.SubW, row.SubH)
+
+def _stats_values(row):
+	return (row.DateTime.strftime("%Y-%m-%d %H:%M"), row.LWC, row.MVD, row.Conc, row.Frames, row.Particles, row.Temp, row.Wind)
+
+def _filter_tables(rows, table_prefixes):
+	dict = {}
+	for row in rows:
+		database = row["TABLE_SCHEMA"]
+		table = row["TABLE_NAME"]
+		
+		for prefix in table_prefixes:
+			if table.startswith(prefix):
+				if not database in dict:
+					dict[database] = []
+				dict[database].append(table)
+	
+	alg = natsort.ns.IGNORECASE
+	odict = OrderedDict(natsort.natsorted(dict.items(), alg=alg))
+	for k, v in odict.items():
+		odict[k] = natsort.natsorted(v, alg=alg)
+	return odict
+
+def _table_fmt(table, particles_fmt=__create_particles_table_fmt__, stats_fmt=__create_stats_table_fmt__):
+	if table.startswith("particles"):
+		return particles_fmt
+	elif table.startswith("stats"):
+		return stats_fmt
+	raise DBException("Table names must start with 'particles' or `stats`")
+
 class ParticlesRow:
 	def __init__(self, **kwargs):
 		self.__dict__ = {**self.__dict__, **kwargs}
@@ -94,6 +161,71 @@ class StatsRow:
 		return obj.icingrate(self.LWC, self.MVD, T, v)
 
 class Database:
+	def __new__(cls, *args, **kwargs):
+		# Plain Database(...) has always meant a MySQL connection
+		if cls is Database:
+			cls = MySQLDatabase
+		return super().__new__(cls)
+	
+	def close(self):
+		raise NotImplementedError()
+	
+	def _tables(self):
+		raise NotImplementedError()
+	
+	def _execute_many(self, query, values):
+		raise NotImplementedError()
+	
+	def _use(self, database):
+		pass
+	
+	def databases(self, table_prefixes=["particles", "stats"]):
+		return _filter_tables(self._tables(), table_prefixes)
+	
+	def particles_databases(self):
+		return self.databases(["particles"])
+	
+	def stats_databases(self):
+		return self.databases(["stats"])
+	
+	def create_table(self, database, table):
+		raise NotImplementedError()
+	
+	def select(self, query, cls=None):
+		raise NotImplementedError()
+	
+	def _select(self, database, query, cls):
+		# The database is taken into use only when the query actually runs
+		self._use(database)
+		yield from self.select(query, cls=cls)
+	
+	def select_particles(self, database, table):
+		return self._select(database, __select_particles_fmt__.format(database, table), ParticlesRow)
+	
+	def select_stats(self, database, table):
+		return self._select(database, __select_stats_fmt__.format(database, table), StatsRow)
+	
+	def insert_particles(self, database, table, rows):
+		self._use(database)
+		values = [_particles_values(row) for row in rows]
+		self._execute_many(__insert_particles_fmt__.format(database, table), values)
+	
+	def insert_stats(self, database, table, rows):
+		self._use(database)
+		values = [_stats_values(row) for row in rows]
+		self._execute_many(__insert_stats_fmt__.format(database, table), values)
+	
+	def update_particles(self, database, table, rows):
+		self._use(database)
+		values = [(*_particles_values(row), row.ID) for row in rows]
+		self._execute_many(__update_particles_fmt__.format(database, table), values)
+	
+	def update_stats(self, database, table, rows):
+		self._use(database)
+		values = [(*_stats_values(row), row.ID) for row in rows]
+		self._execute_many(__update_stats_fmt__.format(database, table), values)
+
+class MySQLDatabase(Database):
 	def __init__(self, **kwargs):
 		self.host = kwargs.get("host", "localhost")
 		self.port = kwargs.get("port", 3306)
@@ -112,40 +244,18 @@ class Database:
 	def close(self):
 		self._conn.close()
 	
-	def databases(self, table_prefixes=["particles", "stats"]):
-		dict = {}
+	def _tables(self):
 		with self._conn.cursor(cursor=pymysql.cursors.SSDictCursor) as curs:
 			curs.execute(__select_tables_fmt__)
-			for row in curs.fetchall_unbuffered():
-				database = row["TABLE_SCHEMA"]
-				table = row["TABLE_NAME"]
-				
-				for prefix in table_prefixes:
-					if table.startswith(prefix):
-						if not database in dict:
-							dict[database] = []
-						dict[database].append(table)
-		
-		alg = natsort.ns.IGNORECASE
-		odict = OrderedDict(natsort.natsorted(dict.items(), alg=alg))
-		for k, v in odict.items():
-			odict[k] = natsort.natsorted(v, alg=alg)
-		return odict
+			return list(curs.fetchall_unbuffered())
 	
-	def particles_databases(self):
-		return self.databases(["particles"])
-	
-	def stats_databases(self):
-		return self.databases(["stats"])
+	def _execute_many(self, query, values):
+		with self._conn.cursor() as curs:
+			curs.executemany(query, values)
+		self._conn.commit()
 	
 	def create_table(self, database, table):
-		if table.startswith("particles"):
-			table_fmt = __create_particles_table_fmt__
-		elif table.startswith("stats"):
-			table_fmt = __create_stats_table_fmt__
-		else:
-			raise DBException("Table names must start with 'particles' or `stats`")
-		
+		table_fmt = _table_fmt(table)
 		with self._conn.cursor() as curs:
 			curs.execute(__create_db_fmt__.format(database))
 			curs.execute(table_fmt.format(database, table))
@@ -156,37 +266,138 @@ class Database:
 			curs.execute(query)
 			for row in curs.fetchall_unbuffered():
 				yield row if cls is None else cls(**row)
+
+class SQLiteDatabase(Database):
+	def __init__(self, **kwargs):
+		# Every database is a file '<database>.db' in the root directory,
+		# attached to the connection under its own name
+		self.root = kwargs.get("root", ".")
+		self.ext = kwargs.get("ext", ".db")
+		os.makedirs(self.root, exist_ok=True)
+		self._conn = sqlite3.connect(":memory:", isolation_level=None)
+		self._attached = OrderedDict()
 	
-	def select_particles(self, database, table):
-		return self.select(__select_particles_fmt__.format(database, table), cls=ParticlesRow)
+	def __repr__(self):
+		return "<Database sqlite:{}>".format(self.root)
 	
-	def select_stats(self, database, table):
-		return self.select(__select_stats_fmt__.format(database, table), cls=StatsRow)
+	def close(self):
+		self._conn.close()
 	
-	def insert_particles(self, database, table, rows):
-		with self._conn.cursor() as curs:
-			for row in rows:
-				t = (row.DateTime.strftime("%Y-%m-%d %H:%M:%S.%f"), row.Sensor, row.Frame, row.Particle, row.X, row.Y, row.Z, row.EquivDiam, row.EquivDiamCorr, row.Circularity, row.DynRange, row.EffPxSz, row.SubX, row.SubY, row.SubW, row.SubH)
-				curs.execute(__insert_particles_fmt__.format(database, table), t)
-		self._conn.commit()
+	def _path(self, database):
+		return os.path.join(self.root, database + self.ext)
 	
-	def insert_stats(self, database, table, rows):
-		with self._conn.cursor() as curs:
-			for row in rows:
-				t = (row.DateTime.strftime("%Y-%m-%d %H:%M"), row.LWC, row.MVD, row.Conc, row.Frames, row.Particles, row.Temp, row.Wind)
-				curs.execute(__insert_stats_fmt__.format(database, table), t)
-		self._conn.commit()
+	def _init_file(self, path):
+		# WAL mode is persistent, but it can't be switched on through the
+		# main connection while any of its statements are active
+		conn = sqlite3.connect(path)
+		try:
+			conn.execute("PRAGMA journal_mode=WAL;")
+		finally:
+			conn.close()
 	
-	def update_particles(self, database, table, rows):
-		with self._conn.cursor() as curs:
-			for row in rows:
-				t = (row.DateTime.strftime("%Y-%m-%d %H:%M:%S.%f"), row.Sensor, row.Frame, row.Particle, row.X, row.Y, row.Z, row.EquivDiam, row.EquivDiamCorr, row.Circularity, row.DynRange, row.EffPxSz, row.SubX, row.SubY, row.SubW, row.SubH, row.ID)
-				curs.execute(__update_particles_fmt__.format(database, table), t)
-		self._conn.commit()
+	def _detach_lru(self):
+		# Databases read or written since an active statement started can't be
+		# detached until it's done, so skip them
+		for database in list(self._attached):
+			try:
+				self._conn.execute("DETACH DATABASE `{}`;".format(database))
+			except sqlite3.OperationalError:
+				continue
+			del self._attached[database]
+			return
+		raise DBException("Too many databases in use")
 	
-	def update_stats(self, database, table, rows):
-		with self._conn.cursor() as curs:
-			for row in rows:
-				t = (row.DateTime.strftime("%Y-%m-%d %H:%M"), row.LWC, row.MVD, row.Conc, row.Frames, row.Particles, row.Temp, row.Wind, row.ID)
-				curs.execute(__update_stats_fmt__.format(database, table), t)
-		self._conn.commit()
+	def _use(self, database):
+		if database in self._attached:
+			self._attached.move_to_end(database)
+			return
+		
+		try:
+			self._init_file(self._path(database))
+			while True:
+				try:
+					self._conn.execute("ATTACH DATABASE ? AS `{}`;".format(database), (self._path(database),))
+					break
+				except sqlite3.OperationalError as e:
+					# SQLite limits the number of attached databases
+					if not "too many attached" in str(e):
+						raise
+					self._detach_lru()
+			try:
+				self._conn.execute("PRAGMA `{}`.synchronous=NORMAL;".format(database))
+			except:
+				self._conn.execute("DETACH DATABASE `{}`;".format(database))
+				raise
+		except sqlite3.Error as e:
+			raise DBException(str(e))
+		self._attached[database] = True
+	
+	def _tables(self):
+		rows = []
+		try:
+			for path in glob.glob(os.path.join(glob.escape(self.root), "*" + self.ext)):
+				database = os.path.basename(path)[:-len(self.ext)]
+				conn = sqlite3.connect(path)
+				try:
+					for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table';"):
+						rows.append({"TABLE_SCHEMA": database, "TABLE_NAME": table})
+				finally:
+					conn.close()
+		except sqlite3.Error as e:
+			raise DBException(str(e))
+		return rows
+	
+	def _execute_many(self, query, values):
+		try:
+			self._conn.execute("BEGIN;")
+			try:
+				self._conn.executemany(query.replace("%s", "?"), values)
+			except:
+				self._conn.execute("ROLLBACK;")
+				raise
+			self._conn.execute("COMMIT;")
+		except sqlite3.Error as e:
+			raise DBException(str(e))
+	
+	def create_table(self, database, table):
+		table_fmt = _table_fmt(table, __create_particles_table_sqlite_fmt__, __create_stats_table_sqlite_fmt__)
+		self._use(database)
+		try:
+			self._conn.executescript(table_fmt.format(database, table))
+		except sqlite3.Error as e:
+			raise DBException(str(e))
+	
+	def select(self, query, cls=None):
+		try:
+			curs = self._conn.execute(query)
+		except sqlite3.Error as e:
+			raise DBException(str(e))
+		try:
+			cols = [d[0] for d in curs.description]
+			while True:
+				try:
+					t = curs.fetchone()
+				except sqlite3.Error as e:
+					raise DBException(str(e))
+				if t is None:
+					break
+				row = dict(zip(cols, t))
+				if isinstance(row.get("DateTime"), str):
+					row["DateTime"] = datetime.fromisoformat(row["DateTime"])
+				yield row if cls is None else cls(**row)
+		finally:
+			try:
+				curs.close()
+			except sqlite3.Error:
+				pass
+
+databases = {
+	"mysql": MySQLDatabase,
+	"sqlite": SQLiteDatabase
+}
+
+def create_database(name, **kwargs):
+	cls = databases.get(name, None)
+	if cls is None:
+		raise DBException("Invalid database backend '{}'".format(name))
+	return cls(**kwargs)
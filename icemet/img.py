@@ -1,10 +1,10 @@
 from icemet.file import File
+from icemet.lazy import lazy_import
 
-import cv2
-import numpy as np
-import torch
-import torchvision.transforms.functional as tf
-from torchvision.transforms import InterpolationMode
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+torch = lazy_import("torch")
+tf = lazy_import("torchvision.transforms.functional")
 
 from collections import deque
 import os
@@ -80,7 +80,7 @@ class Image(File):
 		self.data = tf.resize(
 			self.data,
 			(h, w),
-			interpolation=InterpolationMode.BICUBIC,
+			interpolation=tf.InterpolationMode.BICUBIC,
 			antialias=True
 		)
 		self.data = self._squeeze(self.data)
@@ -0,0 +1,23 @@
+import importlib
+
+class LazyModule:
+	def __init__(self, name):
+		self.__dict__["_name"] = name
+		self.__dict__["_module"] = None
+	
+	def __repr__(self):
+		return "<LazyModule {}>".format(self._name)
+	
+	def _load(self):
+		if self._module is None:
+			self.__dict__["_module"] = importlib.import_module(self._name)
+		return self._module
+	
+	def __getattr__(self, name):
+		return getattr(self._load(), name)
+	
+	def __setattr__(self, name, val):
+		setattr(self._load(), name, val)
+
+def lazy_import(name):
+	return LazyModule(name)
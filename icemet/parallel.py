@@ -0,0 +1,180 @@
+from icemet.file import File
+from icemet.img import Image, BGSubStack
+from icemet.lazy import lazy_import
+
+np = lazy_import("numpy")
+torch = lazy_import("torch")
+
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import os
+
+class Shard:
+	def __init__(self, paths, start, end, key):
+		self.paths = paths
+		self.start = start
+		self.end = end
+		self.key = key
+	
+	def __repr__(self):
+		return "<Shard {}-{} ({} frames)>".format(self.start, self.end, len(self.paths))
+
+def _file_key(file):
+	return (file.datetime, file.frame, file.sensor_id)
+
+def shard_files(paths, size, before, after):
+	# Each sensor's frames are split into chunks of `size` frames. A chunk
+	# also reads `before` and `after` neighboring frames, so that its stack
+	# is full for every frame of the chunk itself.
+	sensors = {}
+	for path in paths:
+		file = File.frompath(path)
+		if not file.sensor_id in sensors:
+			sensors[file.sensor_id] = []
+		sensors[file.sensor_id].append((file, path))
+	
+	shards = {}
+	for sensor_id, files in sensors.items():
+		files.sort(key=lambda t: _file_key(t[0]))
+		n = len(files)
+		shards[sensor_id] = []
+		for start in range(0, n, size):
+			end = min(start+size, n)
+			shards[sensor_id].append(Shard(
+				[path for _, path in files[max(start-before, 0):min(end+after, n)]],
+				start, end, _file_key(files[start][0])
+			))
+	return shards
+
+def _init_worker(threads):
+	# Without this every worker would use all cores
+	torch.set_num_threads(threads)
+
+def _bgsub_shard(paths, stack_len, use_middle, uint8):
+	# Runs in a worker process. The results are written to a shared memory
+	# block owned by the parent after this returns.
+	dtype = np.uint8 if uint8 else np.float32
+	stack = BGSubStack(stack_len, use_middle=use_middle)
+	n = max(len(paths) - stack_len + 1, 0)
+	names = []
+	shm = None
+	arr = None
+	try:
+		for path in paths:
+			if not stack.push(Image.frompath(path)):
+				continue
+			img = stack.meddiv()
+			if shm is None:
+				h, w = img.tensor().size()
+				shm = shared_memory.SharedMemory(create=True, size=n*h*w*np.dtype(dtype).itemsize)
+				arr = np.ndarray((n, h, w), dtype=dtype, buffer=shm.buf)
+			arr[len(names)] = img.numpy(uint8=uint8)
+			names.append(img.name())
+	except:
+		if not shm is None:
+			del arr
+			shm.close()
+			shm.unlink()
+		raise
+	if shm is None:
+		return None, None, None, names
+	shape = arr.shape
+	del arr
+	shm.close()
+	return shm.name, shape, np.dtype(dtype).str, names
+
+def _release(future):
+	if future.cancelled() or not future.exception() is None:
+		return
+	name = future.result()[0]
+	if not name is None:
+		shm = shared_memory.SharedMemory(name=name)
+		shm.close()
+		shm.unlink()
+
+def _collect(future):
+	future.collected = True
+	name, shape, dtype, names = future.result()
+	if name is None:
+		return
+	shm = shared_memory.SharedMemory(name=name)
+	try:
+		arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+		for i, fn in enumerate(names):
+			img = Image(data=arr[i].copy())
+			img.set_name(fn)
+			yield img
+		del arr
+	finally:
+		shm.close()
+		shm.unlink()
+
+class BGSubExecutor:
+	def __init__(self, len, use_middle=True, **kwargs):
+		BGSubStack(len, use_middle=use_middle) # Validate the parameters
+		self.len = len
+		self.use_middle = use_middle
+		self.workers = kwargs.get("workers", None) or os.cpu_count() or 1
+		self.threads = kwargs.get("threads", max((os.cpu_count() or 1) // self.workers, 1))
+		# Every finished shard waits in /dev/shm until it's consumed, so the
+		# shards are kept small and only a few are in flight at a time
+		self.shard_size = kwargs.get("shard_size", 16)
+		self.queue = kwargs.get("queue", self.workers + 1)
+		self.uint8 = kwargs.get("uint8", False)
+		self.context = kwargs.get("context", "spawn")
+		if self.use_middle:
+			self.before, self.after = len//2, len//2
+		else:
+			self.before, self.after = len-1, 0
+	
+	def __repr__(self):
+		return "<BGSubExecutor len={} shard_size={}>".format(self.len, self.shard_size)
+	
+	def map(self, paths):
+		shards = shard_files(paths, self.shard_size, self.before, self.after)
+		pending = sorted(
+			[shard for sensor_shards in shards.values() for shard in sensor_shards],
+			key=lambda shard: shard.key,
+			reverse=True
+		)
+		futures = {}
+		with ProcessPoolExecutor(
+			max_workers=self.workers,
+			mp_context=mp.get_context(self.context),
+			initializer=_init_worker,
+			initargs=(self.threads,)
+		) as executor:
+			def submit(shard):
+				if pending[-1] is shard:
+					pending.pop()
+				else:
+					pending.remove(shard)
+				futures[id(shard)] = executor.submit(_bgsub_shard, shard.paths, self.len, self.use_middle, self.uint8)
+			
+			def fill():
+				# Shards are submitted roughly in the order they are consumed
+				while pending and len(futures) < self.queue:
+					submit(pending[-1])
+			
+			def stream(sensor_shards):
+				for shard in sensor_shards:
+					if not id(shard) in futures:
+						submit(shard)
+					future = futures[id(shard)]
+					yield from _collect(future)
+					del futures[id(shard)]
+					fill()
+			
+			try:
+				fill()
+				yield from heapq.merge(*[stream(s) for s in shards.values()], key=_file_key)
+			finally:
+				# Free the blocks of shards that were never consumed
+				for future in futures.values():
+					future.cancel()
+				executor.shutdown(wait=True)
+				for future in futures.values():
+					if not getattr(future, "collected", False):
+						_release(future)
@@ -1,14 +1,20 @@
 from icemet.file import File, FileStatus
 from icemet.img import Image
+from icemet.lazy import lazy_import
 
-import cv2
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+lz4f = lazy_import("lz4.frame")
 
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 import shutil
+import struct
 import tempfile
 import uuid
 import zipfile
+import zlib
 
 class PackageException(Exception):
 	pass
@@ -120,9 +126,186 @@ class ICEMETPackage1(Package):
 		
 		shutil.move(self._file, path)
 
+# Name: (compress(data, level), decompress(data), default level, level range)
+compressors = {
+	"zlib": (
+		lambda data, level: zlib.compress(data, level),
+		zlib.decompress,
+		1,
+		(-1, 9)
+	),
+	"lz4": (
+		lambda data, level: lz4f.compress(data, compression_level=level),
+		lambda data: lz4f.decompress(data),
+		0,
+		(0, 16)
+	)
+}
+
+def _check_compression(name):
+	if not name in compressors:
+		raise PackageException("Invalid compression '{}'".format(name))
+	if name == "lz4":
+		try:
+			lz4f.compress
+		except ImportError:
+			raise PackageException("Compression 'lz4' requires the lz4 package")
+
+__icemet2_magic__ = b"ICEMET2\n"
+__icemet2_header_fmt__ = "<I"
+
+class ICEMETPackage2(Package):
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+		self._frames = []
+		self._buf = []
+		self._chunks = []
+		self._executor = None
+		
+		self.compression = kwargs.get("compression", "zlib")
+		_check_compression(self.compression)
+		self.level = kwargs.get("level", compressors[self.compression][2])
+		lo, hi = compressors[self.compression][3]
+		if not isinstance(self.level, int) or not lo <= self.level <= hi:
+			raise PackageException("Invalid {} compression level {}".format(self.compression, self.level))
+		self.chunk = kwargs.get("chunk", 1)
+		if self.chunk < 1:
+			raise PackageException("Invalid chunk size {}".format(self.chunk))
+		self.workers = kwargs.get("workers", None)
+	
+	def __del__(self):
+		self._shutdown()
+	
+	def _shutdown(self):
+		if not self._executor is None:
+			self._executor.shutdown(wait=False, cancel_futures=True)
+			self._executor = None
+	
+	def _flush(self):
+		if not self._buf:
+			return
+		if self._executor is None:
+			self._executor = ThreadPoolExecutor(max_workers=self.workers)
+		data = b"".join(self._buf)
+		self._buf = []
+		self._chunks.append(self._executor.submit(compressors[self.compression][0], data, self.level))
+	
+	def add_img(self, img):
+		super().add_img(img)
+		if img.status == FileStatus.NOTEMPTY:
+			self._frames.append(img.name())
+			self._buf.append(img.numpy(uint8=True).tobytes())
+			if len(self._buf) >= self.chunk:
+				self._flush()
+	
+	def save(self, path):
+		self._flush()
+		try:
+			chunks = [future.result() for future in self._chunks]
+		finally:
+			self._shutdown()
+		offsets = [0]
+		for chunk in chunks:
+			offsets.append(offsets[-1] + len(chunk))
+		
+		data = {
+			"size": self.size,
+			"fps": self.fps,
+			"len": self.len,
+			"meas": self.meas,
+			"images": [img.name() for img in self.images],
+			"frames": self._frames,
+			"compression": self.compression,
+			"chunk": self.chunk,
+			"offsets": offsets
+		}
+		header = json.dumps(data).encode("utf-8")
+		
+		tmp = path + ".part"
+		with open(tmp, "wb") as fp:
+			fp.write(__icemet2_magic__)
+			fp.write(struct.pack(__icemet2_header_fmt__, len(header)))
+			fp.write(header)
+			for chunk in chunks:
+				fp.write(chunk)
+		os.replace(tmp, path)
+
+class ICEMETPackage2Reader:
+	def __init__(self, path):
+		self._fp = open(path, "rb")
+		try:
+			if self._fp.read(len(__icemet2_magic__)) != __icemet2_magic__:
+				raise PackageException("Not an ICEMET2 package '{}'".format(path))
+			n = struct.unpack(__icemet2_header_fmt__, self._fp.read(struct.calcsize(__icemet2_header_fmt__)))[0]
+			data = json.loads(self._fp.read(n).decode("utf-8"))
+			_check_compression(data["compression"])
+			if data["chunk"] < 1:
+				raise PackageException("Invalid chunk size {}".format(data["chunk"]))
+		except PackageException:
+			self._fp.close()
+			raise
+		except Exception as e:
+			self._fp.close()
+			raise PackageException("Couldn't parse package header '{}'\n{}".format(path, e))
+		
+		self.size = tuple(data["size"])
+		self.fps = data["fps"]
+		self.len = data["len"]
+		self.meas = data["meas"]
+		self.images = data["images"]
+		self.frames = data["frames"]
+		self.compression = data["compression"]
+		self.chunk = data["chunk"]
+		self._offsets = data["offsets"]
+		self._start = self._fp.tell()
+		self._decompress = compressors[self.compression][1]
+		self._cache = None, None
+	
+	def __repr__(self):
+		return "<ICEMETPackage2Reader {} frames>".format(len(self))
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *args):
+		self.close()
+	
+	def __len__(self):
+		return len(self.frames)
+	
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+	
+	def __getitem__(self, i):
+		if i < 0:
+			i += len(self)
+		if i < 0 or i >= len(self):
+			raise IndexError("Frame index out of range")
+		
+		h, w = self.size
+		n = h * w
+		data = self._read_chunk(i // self.chunk)
+		off = (i % self.chunk) * n
+		mat = np.frombuffer(data, dtype=np.uint8, count=n, offset=off).reshape(h, w).copy()
+		img = Image(data=mat)
+		img.set_name(self.frames[i])
+		return img
+	
+	def _read_chunk(self, j):
+		if self._cache[0] != j:
+			self._fp.seek(self._start + self._offsets[j])
+			data = self._fp.read(self._offsets[j+1] - self._offsets[j])
+			self._cache = j, self._decompress(data)
+		return self._cache[1]
+	
+	def close(self):
+		self._fp.close()
+
 packages = {
 	"dummy": ([".dummy"], DummyPackage),
-	"icemet1": ([".ip1", ".iv1"], ICEMETPackage1)
+	"icemet1": ([".ip1", ".iv1"], ICEMETPackage1),
+	"icemet2": ([".ip2"], ICEMETPackage2)
 }
 packages["icemet"] = packages["icemet1"]
 
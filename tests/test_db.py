@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("natsort")
+pytest.importorskip("pymysql")
+
+from icemet.db import create_database, StatsRow
+
+from datetime import datetime
+
+def _stats(n):
+	return [
+		StatsRow(DateTime=datetime(2024, 1, 1, 0, i), LWC=0.1, MVD=2e-5, Conc=1e6, Frames=10, Particles=100, Temp=-5.0, Wind=None)
+		for i in range(n)
+	]
+
+@pytest.fixture
+def db(tmp_path):
+	db = create_database("sqlite", root=str(tmp_path))
+	yield db
+	db.close()
+
+def test_read_one_write_another(db):
+	db.create_table("src", "stats")
+	db.insert_stats("src", "stats", _stats(5))
+	for row in db.select_stats("src", "stats"):
+		db.create_table("dst", "stats")
+		db.insert_stats("dst", "stats", [row])
+	rows = list(db.select_stats("dst", "stats"))
+	assert [row.DateTime for row in rows] == [row.DateTime for row in _stats(5)]
+	assert rows[0].Temp == -5.0 and rows[0].Wind is None
+
+def test_detach_skips_open_cursors(db):
+	for i in range(10):
+		db.create_table("site{}".format(i), "stats")
+		db.insert_stats("site{}".format(i), "stats", _stats(3))
+	rows = db.select_stats("site0", "stats")
+	next(rows)
+	for i in range(10, 15):
+		db.create_table("site{}".format(i), "stats")
+		db.insert_stats("site{}".format(i), "stats", _stats(1))
+	assert len(list(rows)) == 2
+	assert len(db.stats_databases()) == 15
+	assert len(list(db.select_stats("site1", "stats"))) == 3
+
+def test_select_before_read(db):
+	for i in range(12):
+		db.create_table("site{}".format(i), "stats")
+		db.insert_stats("site{}".format(i), "stats", _stats(2))
+	gens = [db.select_stats("site{}".format(i), "stats") for i in range(12)]
+	for i in range(12):
+		db.insert_stats("site{}".format(11-i), "stats", _stats(1))
+	assert [len(list(gen)) for gen in gens] == [3] * 12